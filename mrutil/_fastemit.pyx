@@ -0,0 +1,105 @@
+# cython: language_level=3str
+# -----------------------------------------------------------------------------
+# Copyright 2015 Plumbee Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# -----------------------------------------------------------------------------
+
+# Compiled version of mrutil.streaming.Emitter, build in place with:
+#   cythonize -i mrutil/_fastemit.pyx
+
+# Modules
+import sys
+
+
+# -----------------------------------------------------------------------------
+# Emitter
+# -----------------------------------------------------------------------------
+cdef class Emitter:
+    """
+    Buffers records emitted through it, formatted as per emit(), in a single
+    bytearray and writes them to the stream in batches. Records are encoded
+    with the stream's encoding and error handler, or UTF-8 and strict if it
+    has none, as the stream itself would.
+    """
+    cdef object _stream
+    cdef object _write
+    cdef object _convert
+    cdef bint _text
+    cdef bint _decode
+    cdef object _encoding
+    cdef object _errors
+    cdef bytearray _buf
+    cdef Py_ssize_t _count
+    cdef Py_ssize_t _batch_size
+
+    def __init__(self, stream=None, Py_ssize_t batch_size=1000):
+        # Imported here as mrutil.streaming imports this module.
+        from mrutil.streaming import _convert
+
+        self._stream = sys.stdout if stream is None else stream
+        self._write = getattr(self._stream, 'buffer', self._stream).write
+        # Text streams over a binary buffer, which is written to directly.
+        self._text = hasattr(self._stream, 'buffer')
+        # Text streams without an underlying buffer, e.g. io.StringIO, which
+        # are given back exactly the text emitted.
+        self._decode = sys.version_info[0] >= 3 and not self._text
+        if self._decode:
+            self._encoding = 'utf-8'
+            self._errors = 'surrogatepass'
+        else:
+            self._encoding = getattr(self._stream, 'encoding', None) or 'utf-8'
+            self._errors = getattr(self._stream, 'errors', None) or 'strict'
+        self._convert = _convert
+        self._buf = bytearray()
+        self._count = 0
+        self._batch_size = batch_size
+
+    cpdef emit(self, key, values, delimiter='\t'):
+        cdef list parts = []
+        cdef object value_type
+        for value in values:
+            value_type = type(value)
+            if value_type is str:
+                parts.append(value)
+            elif value_type is int or value_type is float:
+                parts.append(str(value))
+            else:
+                parts.append(self._convert(value))
+
+        record = '%s\t%s\n' % (key, delimiter.join(parts))
+        if isinstance(record, unicode):
+            record = record.encode(self._encoding, self._errors)
+        self._buf += record
+
+        self._count += 1
+        if self._count >= self._batch_size:
+            self.flush()
+
+    cpdef flush(self):
+        if self._buf:
+            # Anything already written to a text stream must go first.
+            if self._text:
+                self._stream.flush()
+            if self._decode:
+                self._write(self._buf.decode(self._encoding, self._errors))
+            else:
+                self._write(bytes(self._buf))
+            del self._buf[:]
+        self._count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
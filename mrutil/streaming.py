@@ -15,22 +15,129 @@
 # -----------------------------------------------------------------------------
 
 # Modules
-import itertools
+import atexit
+import codecs
 import json
+import mmap
 import operator
 import os
+import re
+import stat
+import struct
 import sys
+import threading
+
+
+def _stdlib_json_dumps(value):
+    return json.dumps(value, separators=(',', ':'))  # Compact output
+
+
+# Optional, faster JSON codecs. Their output differs from the standard
+# library's (see README.md), so they are only used when MRUTIL_FAST_JSON is
+# set. orjson always produces compact output and returns bytes, so decode to
+# keep emit() writing text. Records it cannot encode, such as those holding
+# integers wider than 64 bits, or decode, such as those with NaN literals, go
+# through the standard library instead. simdjson decodes LazyJson records
+# when orjson is not available, orjson being the faster of the two for full
+# decodes; its parsers reuse their buffers so one is kept per thread.
+orjson = None
+simdjson = None
+if os.environ.get('MRUTIL_FAST_JSON', '0') != '0':
+    try:
+        import orjson
+    except ImportError:
+        pass
+    try:
+        import simdjson
+    except ImportError:
+        pass
+
+if orjson is not None:
+    def _json_dumps(value):
+        try:
+            return orjson.dumps(
+                value, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+        except TypeError:
+            return _stdlib_json_dumps(value)
+
+    def _json_loads(raw):
+        try:
+            return orjson.loads(raw)
+        except ValueError:
+            return json.loads(raw)
+else:
+    _json_dumps = _stdlib_json_dumps
+    _json_loads = json.loads
+
+_local = threading.local()
+
+# Optional, used for binary framed records.
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 KV_SEPARATOR = '\t'
 
+# Hadoop Streaming records are always newline terminated, whatever the OS.
+_NL = '\n'
+_SEP = KV_SEPARATOR
+
 INPUT_FORMAT_SEQUENCE_FILE = "SEQUENCE_FILE"
 INPUT_FORMAT_TEXT_FILE = "TEXT_FILE"
 
+# Hadoop Streaming '-io rawbytes' frames the key and the value each with a
+# 4 byte big endian length.
+_RAWBYTES_LENGTH = struct.Struct('>i')
+
 
 # -----------------------------------------------------------------------------
 # emit
 # -----------------------------------------------------------------------------
-def emit(key, values, delimiter='\t', stream=sys.stdout):
+# bool is a subclass of int, so False/True index the tuple directly.
+_BOOL_STRINGS = ('FALSE', 'TRUE')
+_bool_str = _BOOL_STRINGS.__getitem__
+
+
+_CONVERTERS = {
+    dict: _json_dumps,
+    list: _json_dumps,
+    bool: _bool_str,
+}
+
+
+def _converter_for(value_type):
+    converter = _CONVERTERS.get(value_type)
+    if converter is None:
+        if issubclass(value_type, (dict, list)):
+            converter = _json_dumps
+        else:
+            converter = str
+        _CONVERTERS[value_type] = converter
+    return converter
+
+
+def _convert(value, _get=_CONVERTERS.get):
+    return (_get(type(value)) or _converter_for(type(value)))(value)
+
+
+def _format_record(key, values, delimiter, _sep=_SEP, _nl=_NL,
+                   _converter_for=_converter_for, _convert=_convert):
+    # Values are usually all of the same type, in which case a single
+    # converter can be mapped over them without any per value dispatch.
+    if not isinstance(values, (list, tuple)):
+        values = list(values)
+    value_types = set(map(type, values))
+    if len(value_types) == 1:
+        converter = _converter_for(value_types.pop())
+    else:
+        converter = _convert
+    return '%s%s%s%s' % (
+        key, _sep, delimiter.join(map(converter, values)), _nl)
+
+
+def emit(key, values, delimiter='\t', stream=sys.stdout,
+         _format_record=_format_record):
     """
     Emit a key value pair for processing by the MapReduce framework.
     :param key: The key to partition the data on. All keys of the same value
@@ -42,54 +149,486 @@ def emit(key, values, delimiter='\t', stream=sys.stdout):
            string.
     :param stream: The stream to write the output to, defaults to STDOUT.
     """
-    def convert(value):
-        if isinstance(value, (dict, list)):
-            return json.dumps(value, separators=(',', ':'))  # Compact output
-        elif isinstance(value, bool):
-            return str(value).upper()
+    stream.write(_format_record(key, values, delimiter))
+
+
+# -----------------------------------------------------------------------------
+# make_emit
+# -----------------------------------------------------------------------------
+def make_emit(schema, delimiter='\t'):
+    """
+    Create an emit() function specialised for values of a fixed schema. The
+    conversion of each value is decided once, up front, and compiled into
+    the returned function.
+
+    Example:
+      emit_counts = make_emit([str, int, bool])
+      emit_counts('key', ['A', 10, True])  # -> key\tA\t10\tTRUE
+
+    :param schema: The types of the values, in the order they are emitted.
+    :param delimiter: The delimiter to be used when converting the values to a
+           string.
+
+    :return: A function taking the key, the values and optionally the stream
+             to write to, which produces the same output as emit().
+    """
+    names = ['v{}'.format(i) for i in range(len(schema))]
+    fields = []
+    for name, value_type in zip(names, schema):
+        if value_type is str:
+            fields.append(name)
+        elif value_type is bool:
+            fields.append('_bool_str({})'.format(name))
+        elif issubclass(value_type, (dict, list)):
+            fields.append('_json_dumps({})'.format(name))
         else:
-            return str(value)
+            fields.append('str({})'.format(name))
+
+    lines = ['def emit(key, values, stream=_stdout):']
+    if names:
+        lines.append('    {}, = values'.format(', '.join(names)))
+    lines.append('    stream.write(str(key) + {!r} + {} + {!r})'.format(
+        KV_SEPARATOR, ' + {!r} + '.format(delimiter).join(fields) or "''",
+        _NL))
+
+    namespace = {
+        '_bool_str': _bool_str,
+        '_json_dumps': _json_dumps,
+        '_stdout': sys.stdout,
+    }
+    exec(compile('\n'.join(lines), '<make_emit>', 'exec'), namespace)
+    return namespace['emit']
+
+
+# -----------------------------------------------------------------------------
+# emit_many
+# -----------------------------------------------------------------------------
+def emit_many(key, rows, delimiter='\t', stream=sys.stdout, batch_size=1000):
+    """
+    Emit a key value pair for each row of values, as per emit(). Records are
+    written to the stream in batches to reduce the number of writes.
+    :param key: The key to partition the data on.
+    :param rows: An iterable of values, each of which is emitted as a record.
+    :param delimiter: The delimiter to be used when converting the values to a
+           string.
+    :param stream: The stream to write the output to, defaults to STDOUT.
+    :param batch_size: The number of records written to the stream at once.
+    """
+    format_record = _format_record
+    batch = []
+    for values in rows:
+        batch.append(format_record(key, values, delimiter))
+        if len(batch) >= batch_size:
+            stream.write(''.join(batch))
+            batch = []
+    if batch:
+        stream.write(''.join(batch))
+
+
+# -----------------------------------------------------------------------------
+# emit_buffered
+# -----------------------------------------------------------------------------
+_emit_lock = threading.Lock()
+# The buffers of every thread which has called emit_buffered(), as (thread,
+# buffers) pairs guarded by _emit_lock. Thread local storage is not reliably
+# finalised when a thread exits, so the buffers of exited threads are written
+# out from here instead.
+_all_thread_buffers = []
+
+
+class _ThreadBuffer(object):
+    __slots__ = ('parts', 'size')
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+
+class _ThreadBuffers(dict):
+    """
+    The buffers of a thread keyed by stream.
+    """
+    __slots__ = ()
+
+    def flush(self):
+        for stream, buf in list(self.items()):
+            if not getattr(stream, 'closed', False):
+                _flush_thread_buffer(buf, stream)
+
+
+def _thread_buffers():
+    buffers = getattr(_local, 'emit_buffers', None)
+    if buffers is None:
+        buffers = _local.emit_buffers = _ThreadBuffers()
+        _flush_exited_thread_buffers()
+        with _emit_lock:
+            _all_thread_buffers.append((threading.current_thread(), buffers))
+    return buffers
+
+
+def _flush_thread_buffer(buf, stream):
+    if buf.parts:
+        data = ''.join(buf.parts)
+        buf.parts = []
+        buf.size = 0
+        with _emit_lock:
+            stream.write(data)
+
+
+def _flush_exited_thread_buffers():
+    with _emit_lock:
+        exited = [buffers for thread, buffers in _all_thread_buffers
+                  if not thread.is_alive()]
+        _all_thread_buffers[:] = [(thread, buffers)
+                                  for thread, buffers in _all_thread_buffers
+                                  if thread.is_alive()]
+    for buffers in exited:
+        buffers.flush()
+
+
+@atexit.register
+def _flush_thread_buffers_at_exit():
+    # Non-daemon threads have been joined by the time atexit handlers run,
+    # which leaves the main thread and any daemon threads still running.
+    _flush_exited_thread_buffers()
+    buffers = getattr(_local, 'emit_buffers', None)
+    if buffers is not None:
+        buffers.flush()
+
+
+def emit_buffered(key, values, delimiter='\t', stream=sys.stdout,
+                  buffer_size=65536):
+    """
+    Emit a key value pair as per emit(), buffering the output in a buffer
+    private to the calling thread. Threads emitting to the same stream only
+    synchronise when a buffer is written out.
+
+    NOTE: Records are not written to the stream until the buffer holds
+    buffer_size characters, flush_emit() is called from the same thread, or
+    the thread has exited and flush_emit() is called from any thread. Records
+    left in the buffers of the main thread and of exited threads are written
+    out at interpreter exit, while those of daemon threads still running are
+    lost. Call flush_emit() before writing to the stream by any other means,
+    e.g. emit(), to keep the output in order.
+
+    :param key: The key to partition the data on.
+    :param values: The data associated to the key as a iterable.
+    :param delimiter: The delimiter to be used when converting the values to a
+           string.
+    :param stream: The stream to write the output to, defaults to STDOUT.
+    :param buffer_size: The number of characters buffered before writing.
+    """
+    buffers = _thread_buffers()
+    buf = buffers.get(stream)
+    if buf is None:
+        buf = buffers[stream] = _ThreadBuffer()
+    record = _format_record(key, values, delimiter)
+    buf.parts.append(record)
+    buf.size += len(record)
+    if buf.size >= buffer_size:
+        _flush_thread_buffer(buf, stream)
+
+
+# -----------------------------------------------------------------------------
+# flush_emit
+# -----------------------------------------------------------------------------
+def flush_emit(stream=sys.stdout):
+    """
+    Flush any output emitted to the stream that is still buffered, including
+    the records buffered by emit_buffered() in the calling thread and in
+    threads which have exited.
+    :param stream: The stream to flush, defaults to STDOUT.
+    """
+    _flush_exited_thread_buffers()
+    buf = _thread_buffers().get(stream)
+    if buf is not None:
+        _flush_thread_buffer(buf, stream)
+    stream.flush()
+
+
+# -----------------------------------------------------------------------------
+# emit_msgpack
+# -----------------------------------------------------------------------------
+def emit_msgpack(key, values, stream=sys.stdout):
+    """
+    Emit a key value pair with the key and the values each encoded as
+    MessagePack. Values are written in their binary form, avoiding any
+    conversion to and from strings, and can be read back with
+    map_msgpack_record_reader().
+
+    NOTE: The output is binary and framed as per Hadoop Streaming's rawbytes
+    format, so the job must be run with '-io rawbytes'. It cannot be passed
+    through the default line based format.
+
+    :param key: The key of the record.
+    :param values: The data associated to the key as a iterable.
+    :param stream: The stream to write the output to, defaults to STDOUT. Text
+           streams are flushed and then written to through their underlying
+           binary buffer.
+    """
+    if msgpack is None:
+        raise RuntimeError("emit_msgpack requires msgpack to be installed")
+    if not isinstance(values, (list, tuple)):
+        values = list(values)
+    key = msgpack.packb(key, use_bin_type=True)
+    values = msgpack.packb(values, use_bin_type=True)
+
+    raw = getattr(stream, 'buffer', None)
+    if raw is None:
+        raw = stream
+    else:
+        # Anything already written to the text stream must go first.
+        stream.flush()
+    pack = _RAWBYTES_LENGTH.pack
+    raw.write(b''.join((pack(len(key)), key, pack(len(values)), values)))
+
 
-    stream.write(''.join([
-        str(key), KV_SEPARATOR,
-        delimiter.join(map(convert, values)), os.linesep]))
+# -----------------------------------------------------------------------------
+# Emitter
+# -----------------------------------------------------------------------------
+class Emitter(object):
+    """
+    Buffers records emitted through it, formatted as per emit(), and writes
+    them to the stream in batches. Can be used as a context manager to flush
+    any remaining records on exit. A compiled version from mrutil._fastemit
+    replaces this class when it has been built.
+    """
+    __slots__ = ('_stream', '_batch_size', '_batch')
+
+    def __init__(self, stream=sys.stdout, batch_size=1000):
+        """
+        :param stream: The stream to write the output to, defaults to STDOUT.
+        :param batch_size: The number of records written to the stream at
+               once.
+        """
+        self._stream = stream
+        self._batch_size = batch_size
+        self._batch = []
+
+    def emit(self, key, values, delimiter='\t'):
+        batch = self._batch
+        batch.append(_format_record(key, values, delimiter))
+        if len(batch) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._batch:
+            self._stream.write(''.join(self._batch))
+            self._batch = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+
+# Kept for comparison with the compiled version.
+_PythonEmitter = Emitter
+
+try:
+    from mrutil._fastemit import Emitter
+except ImportError:
+    pass
+
+
+# -----------------------------------------------------------------------------
+# LazyJson
+# -----------------------------------------------------------------------------
+def _lazy_json_loads(raw):
+    if orjson is not None or simdjson is None:
+        return _json_loads(raw)
+    parser = getattr(_local, 'parser', None)
+    if parser is None:
+        parser = _local.parser = simdjson.Parser()
+    return parser.parse(raw, recursive=True)
+
+
+class LazyJson(object):
+    """
+    A JSON record which is only decoded the first time its contents are
+    accessed. Records which are passed through untouched can be re-emitted
+    using the raw attribute without ever being decoded.
+    """
+    __slots__ = ('_raw', '_parsed')
+
+    _UNPARSED = object()
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._parsed = LazyJson._UNPARSED
+
+    @property
+    def raw(self):
+        return self._raw
+
+    @property
+    def value(self):
+        if self._parsed is LazyJson._UNPARSED:
+            self._parsed = _lazy_json_loads(self._raw)
+        return self._parsed
+
+    def get(self, key, default=None):
+        return self.value.get(key, default)
+
+    def __getitem__(self, key):
+        return self.value[key]
+
+    def __contains__(self, key):
+        return key in self.value
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyJson):
+            other = other.value
+        return self.value == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'LazyJson({!r})'.format(self._raw)
 
 
 # -----------------------------------------------------------------------------
 # map_json_record_reader
 # -----------------------------------------------------------------------------
 def map_json_record_reader(stream=sys.stdin,
-                           input_format=INPUT_FORMAT_SEQUENCE_FILE):
+                           input_format=INPUT_FORMAT_SEQUENCE_FILE,
+                           lazy=False):
     """
     Generator function for reading a stream of JSON based records.
     :param stream: The stream to read data from, defaults to STDIN.
     :param input_format: The type of data being read.
+    :param lazy: If True, values are returned as LazyJson objects which are
+           only decoded when accessed.
 
     :return: A tuple containing the key and it's associated value. The value
              will be a decoded representation (an object) of the underlying
              streams JSON data.
 
-             For TEXT_FILE based input, the key represents the offset of the
-             data being processed.
+             For TEXT_FILE based input, the key represents the byte offset of
+             the data being processed.
     """
-    offset = 0
-    for line in stream:
-        if input_format == INPUT_FORMAT_SEQUENCE_FILE:
-            k, _, v = line.rstrip().partition(KV_SEPARATOR)
-            yield (k, json.loads(v))
-        elif input_format == INPUT_FORMAT_TEXT_FILE:
-            yield (offset, json.loads(line.rstrip()))
-            offset += len(line)
-        else:
-            raise RuntimeError("Unknown input_format '{}'".format(input_format))
+    # Module globals are bound to locals for the per line loops.
+    loads = LazyJson if lazy else _json_loads
+    separator = KV_SEPARATOR
+    if input_format == INPUT_FORMAT_SEQUENCE_FILE:
+        for line in stream:
+            k, _, v = line.rstrip().partition(separator)
+            yield (k, loads(v))
+    elif input_format == INPUT_FORMAT_TEXT_FILE:
+        # Offsets are byte offsets, so decoded lines are measured in their
+        # encoded form, using the stream's error handler so that, for example,
+        # surrogate escaped bytes count as one. Undecoded lines are only
+        # decoded for LazyJson, which must keep text so that its raw value can
+        # be emitted again.
+        encoding = getattr(stream, 'encoding', None) or 'utf-8'
+        errors = getattr(stream, 'errors', None) or 'strict'
+        decode = loads is LazyJson and bytes is not str
+        lines = _mapped_lines(stream) or stream
+        offset = 0
+        for line in lines:
+            if isinstance(line, bytes):
+                size = len(line)
+                if decode:
+                    line = line.decode(encoding)
+            else:
+                size = len(line.encode(encoding, errors))
+            yield (offset, loads(line.rstrip()))
+            offset += size
+    else:
+        raise RuntimeError("Unknown input_format '{}'".format(input_format))
+
+
+def _mapped_lines(stream):
+    # Regular files are memory mapped and scanned for newlines, avoiding the
+    # buffered reads and copies of line iteration. Returns None for anything
+    # else, such as the pipe Hadoop Streaming normally provides. Files which
+    # have already been read from are not mapped, as tell() reports the read
+    # ahead position rather than that of the next line. Nor are text streams
+    # which decode other than strict UTF-8, as mapped lines are decoded as
+    # such.
+    encoding = getattr(stream, 'encoding', None)
+    if encoding is not None and codecs.lookup(encoding).name != 'utf-8':
+        return None
+    if getattr(stream, 'errors', None) not in (None, 'strict'):
+        return None
+    try:
+        fd = stream.fileno()
+        position = stream.tell()
+    except (AttributeError, EnvironmentError, ValueError):
+        return None
+    info = os.fstat(fd)
+    if position != 0 or not stat.S_ISREG(info.st_mode) or info.st_size == 0:
+        return None
+    return _iter_mapped_lines(mmap.mmap(fd, 0, access=mmap.ACCESS_READ))
+
+
+def _iter_mapped_lines(mapping):
+    position = 0
+    try:
+        find = mapping.find
+        size = len(mapping)
+        while position < size:
+            end = find(b'\n', position) + 1 or size
+            yield mapping[position:end]
+            position = end
+    finally:
+        mapping.close()
+
+
+# -----------------------------------------------------------------------------
+# map_msgpack_record_reader
+# -----------------------------------------------------------------------------
+def map_msgpack_record_reader(stream=sys.stdin):
+    """
+    Generator function for reading a stream of MessagePack records in Hadoop
+    Streaming's rawbytes format, as written by emit_msgpack().
+    :param stream: The stream to read data from, defaults to STDIN. Text
+           streams are read through their underlying binary buffer, so must
+           not have been read from as text.
+
+    :return: A tuple containing the key and a list of it's associated values.
+    """
+    if msgpack is None:
+        raise RuntimeError(
+            "map_msgpack_record_reader requires msgpack to be installed")
+    read = getattr(stream, 'buffer', stream).read
+    while True:
+        header = read(_RAWBYTES_LENGTH.size)
+        if not header:
+            return
+        key = _read_rawbytes(read, header)
+        values = _read_rawbytes(read, read(_RAWBYTES_LENGTH.size))
+        yield (msgpack.unpackb(key, raw=False),
+               msgpack.unpackb(values, raw=False))
+
+
+def _read_rawbytes(read, header):
+    if len(header) != _RAWBYTES_LENGTH.size:
+        raise RuntimeError("Truncated rawbytes record")
+    size, = _RAWBYTES_LENGTH.unpack(header)
+    data = read(size)
+    if len(data) != size:
+        raise RuntimeError("Truncated rawbytes record")
+    return data
 
 
 # -----------------------------------------------------------------------------
 # reduce_record_reader
 # -----------------------------------------------------------------------------
 def reduce_record_grouper(stream=sys.stdin,
-                          key_func=operator.itemgetter(0),
-                          delimiter='\t'):
+                          key_func=None,
+                          delimiter='\t',
+                          maxsplit=-1):
     """
     Function that groups a stream of data together on a given key returning the
     key itself and the associated values as an iterator. NOTE: The input stream
@@ -110,31 +649,62 @@ def reduce_record_grouper(stream=sys.stdin,
 
     :param stream: The stream to read data from, defaults to STDIN.
     :param key_func: The function used to compute the key on which to group
-           data together.
+           data together, given a (key, value) tuple. Defaults to grouping on
+           the key itself.
     :param delimiter: The delimiter used to split the values associated to the
            key. This is typically the same as passed to emit() during the map
-           phase.
+           phase. A list or tuple of delimiters splits on any of them.
+    :param maxsplit: The maximum number of splits made on each value, the
+           remainder being returned as the last item. Defaults to no limit.
 
     :return: A tuple containing the value of the grouping operation and all the
              values associated to that group as a list of lists.
     """
-    def reader():
-        while True:
-            k, _, v = stream.next().rstrip().partition(KV_SEPARATOR)
-            yield k, v
+    # Several delimiters are split on with a single compiled pattern, which
+    # tries the longest delimiters first.
+    pattern = None
+    if isinstance(delimiter, (list, tuple)):
+        pattern = re.compile('|'.join(
+            re.escape(d) for d in sorted(delimiter, key=len, reverse=True)))
 
-    for key, values in itertools.groupby(reader(), key=key_func):
-        if delimiter:
-            yield (key, list(value.split(delimiter) for key, value in values))
+    def group(values):
+        if not delimiter:
+            return values
+        elif pattern is None:
+            return [value.split(delimiter, maxsplit) for value in values]
+        elif maxsplit == 0:
+            return [[value] for value in values]
         else:
-            yield (key, list(value for key, value in values))
+            # Unlike str.split(), re uses 0 for no limit.
+            split = pattern.split
+            limit = max(maxsplit, 0)
+            return [split(value, limit) for value in values]
+
+    # Groups are built inline as runs of equal keys, which for the default
+    # key is a single comparison per line.
+    separator = KV_SEPARATOR
+    group_key = None
+    values = []
+    for line in stream:
+        k, _, v = line.rstrip().partition(separator)
+        if key_func is not None:
+            k = key_func((k, v))
+        if values and k != group_key:
+            yield (group_key, group(values))
+            values = []
+        values.append(v)
+        group_key = k
+
+    if values:
+        yield (group_key, group(values))
 
 
 # -----------------------------------------------------------------------------
 # time_based_sessionizer
 # -----------------------------------------------------------------------------
 def time_based_sessionizer(events, inactivity_timeout,
-                           key_func=operator.itemgetter(0)):
+                           key_func=operator.itemgetter(0),
+                           as_arrays=False):
     """
     Sessionize/SubGroup a collection of events based on a configurable period
     of inactivity. Note: The event input data must be presorted and must
@@ -145,20 +715,46 @@ def time_based_sessionizer(events, inactivity_timeout,
            is created.
     :param key_func: The function used to return the timestamp within the
            collection of events.
+    :param as_arrays: If True, the events of each session are returned as a
+           numpy array rather than a list. Rows made up only of numbers give a
+           numeric array, anything else an object array. Requires numpy.
 
     :return: A tuple containing the session start and end timestamps along
-             with the events that contributed to that session in a list.
+             with the events that contributed to that session in a list, or
+             in a numpy array when as_arrays is True.
     """
+    if as_arrays:
+        # numpy is slow to import, so it is only imported when needed.
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            raise RuntimeError("as_arrays requires numpy to be installed")
+        convert = _as_array
+    else:
+        convert = None
+
     data = []
     prev_timestamp = None
     for row in events:
         curr_timestamp = int(key_func(row))
         if prev_timestamp and curr_timestamp - prev_timestamp > inactivity_timeout:
-            yield (int(key_func(data[0])), int(key_func(data[-1])), data)
+            yield (int(key_func(data[0])), int(key_func(data[-1])),
+                   convert(data) if convert else data)
             data = []
         data.append(row)
         prev_timestamp = curr_timestamp
 
     if len(data):
-        yield (int(key_func(data[0])), int(key_func(data[-1])), data)
+        yield (int(key_func(data[0])), int(key_func(data[-1])),
+               convert(data) if convert else data)
+
 
+def _as_array(rows):
+    import numpy
+    try:
+        array = numpy.array(rows)
+    except ValueError:  # Rows of differing lengths
+        array = None
+    if array is None or array.dtype.kind not in 'biuf':
+        array = numpy.array(rows, dtype=object)
+    return array
@@ -17,11 +17,29 @@
 # -----------------------------------------------------------------------------
 
 # Modules
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
 import StringIO
 
 from mrutil import streaming
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from mrutil import _fastemit
+except ImportError:
+    _fastemit = None
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
 
 # -----------------------------------------------------------------------------
 # TestEmit
@@ -44,6 +62,128 @@ class TestEmit(unittest.TestCase):
         self.assertEqual(self.output_stream.getvalue(),
             'boolean\tTRUE\tFALSE\n')
 
+    def testMixed(self):
+        streaming.emit('mixed', iter([1, True, [2], "x"]),
+                       stream=self.output_stream)
+        self.assertEqual(self.output_stream.getvalue(),
+            'mixed\t1\tTRUE\t[2]\tx\n')
+
+    def testMakeEmit(self):
+        values = ["A", 1, 2.5, True, {"key": "value"}, [1]]
+        emit = streaming.make_emit([str, int, float, bool, dict, list],
+                                   delimiter=',')
+        emit('schema', values, stream=self.output_stream)
+        streaming.emit('schema', values, delimiter=',',
+                       stream=self.output_stream)
+        expected = 'schema\tA,1,2.5,TRUE,{"key":"value"},[1]\n'
+        self.assertEqual(self.output_stream.getvalue(), expected * 2)
+
+    def testEmitMany(self):
+        streaming.emit_many('many', [[1, 2], [3, 4], [5, 6]],
+                            stream=self.output_stream, batch_size=2)
+        self.assertEqual(self.output_stream.getvalue(),
+            'many\t1\t2\nmany\t3\t4\nmany\t5\t6\n')
+
+
+# -----------------------------------------------------------------------------
+# TestEmitBuffered
+# -----------------------------------------------------------------------------
+class TestEmitBuffered(unittest.TestCase):
+
+    def setUp(self):
+        self.output_stream=StringIO.StringIO()
+
+    def tearDown(self):
+        self.output_stream.close()
+
+    def testFlush(self):
+        streaming.emit_buffered('a', [1], stream=self.output_stream)
+        self.assertEqual(self.output_stream.getvalue(), '')
+        streaming.flush_emit(stream=self.output_stream)
+        self.assertEqual(self.output_stream.getvalue(), 'a\t1\n')
+
+    def testThreads(self):
+        def worker(name):
+            for i in range(100):
+                streaming.emit_buffered(name, [i], stream=self.output_stream,
+                                        buffer_size=64)
+            streaming.flush_emit(stream=self.output_stream)
+
+        threads = [threading.Thread(target=worker, args=(str(n),))
+                   for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        lines = self.output_stream.getvalue().splitlines()
+        self.assertEqual(sorted(lines), sorted(
+            '{}\t{}'.format(n, i) for n in range(4) for i in range(100)))
+
+    def testThreadExit(self):
+        thread = threading.Thread(target=streaming.emit_buffered,
+                                  args=('a', [1]),
+                                  kwargs={'stream': self.output_stream})
+        thread.start()
+        thread.join()
+        self.assertEqual(self.output_stream.getvalue(), '')
+        streaming.flush_emit(stream=self.output_stream)
+        self.assertEqual(self.output_stream.getvalue(), 'a\t1\n')
+
+    def testInterpreterExit(self):
+        script = ("import threading\n"
+                  "from mrutil import streaming\n"
+                  "streaming.emit('a', [1])\n"
+                  "streaming.emit_buffered('b', [2])\n"
+                  "thread = threading.Thread(target=streaming.emit_buffered,\n"
+                  "                          args=('c', [3]))\n"
+                  "thread.start()\n"
+                  "thread.join()\n")
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         cwd=os.path.dirname(TESTS_DIR))
+        self.assertEqual(sorted(output.splitlines()), ['a\t1', 'b\t2', 'c\t3'])
+
+
+# -----------------------------------------------------------------------------
+# TestEmitter
+# -----------------------------------------------------------------------------
+class TestEmitter(unittest.TestCase):
+
+    def setUp(self):
+        self.output_stream=StringIO.StringIO()
+
+    def tearDown(self):
+        self.output_stream.close()
+
+    def testBatching(self):
+        with streaming.Emitter(stream=self.output_stream,
+                               batch_size=2) as emitter:
+            emitter.emit('a', [1, True])
+            self.assertEqual(self.output_stream.getvalue(), '')
+            emitter.emit('b', [{"key": "value"}])
+            self.assertEqual(self.output_stream.getvalue(),
+                'a\t1\tTRUE\nb\t{"key":"value"}\n')
+            emitter.emit('c', ["x", "y"], delimiter=',')
+        self.assertEqual(self.output_stream.getvalue(),
+            'a\t1\tTRUE\nb\t{"key":"value"}\nc\tx,y\n')
+
+    @unittest.skipIf(_fastemit is None, "mrutil._fastemit is not built")
+    def testCompiled(self):
+        records = [('a', [1, True, 2.5], '\t'),
+                   ('b', [{"key": "value"}, [1], None], ','),
+                   ('c', ["x", "y"], '\t')]
+        for stream_type in (StringIO.StringIO, tempfile.TemporaryFile):
+            outputs = []
+            for emitter_type in (streaming._PythonEmitter, _fastemit.Emitter):
+                stream = stream_type()
+                with emitter_type(stream=stream, batch_size=2) as emitter:
+                    for key, values, delimiter in records:
+                        emitter.emit(key, values, delimiter=delimiter)
+                stream.seek(0)
+                outputs.append(stream.read())
+                stream.close()
+            self.assertEqual(outputs[0], outputs[1])
+
 
 # -----------------------------------------------------------------------------
 # TestMapJsonRecordReader
@@ -80,6 +220,130 @@ class TestMapJsonRecordReader(unittest.TestCase):
         self.assertEqual(output.next(), (11, {"G": "H"}))
         self.assertRaises(StopIteration, next, output)
 
+    def testTextFileMultibyte(self):
+        self.input_stream.write(u'{"E": "\u00e9"}\n')
+        self.input_stream.write(u'{"G": "H"}\n')
+        self.input_stream.seek(0)
+
+        output = streaming.map_json_record_reader(
+            stream=self.input_stream,
+            input_format=streaming.INPUT_FORMAT_TEXT_FILE, lazy=True)
+        offset, value = output.next()
+        self.assertEqual(offset, 0)
+        self.assertEqual(value.raw, u'{"E": "\u00e9"}')
+        self.assertEqual(value, {"E": u"\u00e9"})
+        self.assertEqual(output.next(), (12, {"G": "H"}))
+        self.assertRaises(StopIteration, next, output)
+
+    def testTextFileSurrogateEscaped(self):
+        # u'\udcff' is how a stream decoding with surrogateescape represents
+        # the undecodable byte 0xff, which counts as a single byte.
+        self.input_stream.encoding = 'ascii'
+        self.input_stream.errors = (
+            'surrogateescape' if sys.version_info[0] >= 3 else 'replace')
+        self.input_stream.write(u'{"E": "\udcff"}\n')
+        self.input_stream.write(u'{"G": "H"}\n')
+        self.input_stream.seek(0)
+
+        output = streaming.map_json_record_reader(
+            stream=self.input_stream,
+            input_format=streaming.INPUT_FORMAT_TEXT_FILE)
+        self.assertEqual(output.next(), (0, {"E": u"\udcff"}))
+        self.assertEqual(output.next(), (11, {"G": "H"}))
+        self.assertRaises(StopIteration, next, output)
+
+    def testTextFileMapped(self):
+        with tempfile.TemporaryFile() as input_file:
+            input_file.write('{"E": "F"}\n{"G": "H"}')
+            input_file.seek(0)
+
+            output = streaming.map_json_record_reader(
+                stream=input_file,
+                input_format=streaming.INPUT_FORMAT_TEXT_FILE)
+            self.assertEqual(output.next(), (0,  {"E": "F"}))
+            self.assertEqual(output.next(), (11, {"G": "H"}))
+            self.assertRaises(StopIteration, next, output)
+
+    def testTextFileLatin1(self):
+        with tempfile.NamedTemporaryFile() as input_file:
+            input_file.write('{"E": "\xe9"}\n{"G": "H"}\n')
+            input_file.flush()
+
+            for lazy in (False, True):
+                with io.open(input_file.name, encoding='latin-1') as stream:
+                    output = streaming.map_json_record_reader(
+                        stream=stream,
+                        input_format=streaming.INPUT_FORMAT_TEXT_FILE,
+                        lazy=lazy)
+                    self.assertEqual(output.next(), (0,  {"E": u"\xe9"}))
+                    self.assertEqual(output.next(), (11, {"G": "H"}))
+                    self.assertRaises(StopIteration, next, output)
+
+    def testTextFilePartlyRead(self):
+        with tempfile.TemporaryFile() as input_file:
+            for i in range(1000):
+                input_file.write('{{"A": {:4d}}}\n'.format(i))
+            input_file.seek(0)
+            next(iter(input_file))
+
+            output = streaming.map_json_record_reader(
+                stream=input_file,
+                input_format=streaming.INPUT_FORMAT_TEXT_FILE)
+            records = list(output)
+            self.assertEqual(len(records), 999)
+            self.assertEqual(records[0], (0, {"A": 1}))
+            self.assertEqual(records[-1], (998 * 12, {"A": 999}))
+
+    def testLazy(self):
+        self.input_stream.write('1\t{"A": "B"}\n')
+        self.input_stream.seek(0)
+
+        output = streaming.map_json_record_reader(
+            stream=self.input_stream, lazy=True)
+        key, value = output.next()
+        self.assertEqual(key, "1")
+        self.assertEqual(value.raw, '{"A": "B"}')
+        self.assertEqual(value["A"], "B")
+        self.assertEqual(value, {"A": "B"})
+        self.assertRaises(StopIteration, next, output)
+
+
+# -----------------------------------------------------------------------------
+# TestMsgpack
+# -----------------------------------------------------------------------------
+@unittest.skipIf(streaming.msgpack is None, "requires msgpack")
+class TestMsgpack(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = StringIO.StringIO()
+
+    def tearDown(self):
+        self.stream.close()
+
+    def testRoundTrip(self):
+        streaming.emit_msgpack('a', [1, True, {"key": "value"}],
+                               stream=self.stream)
+        streaming.emit_msgpack('b', iter([2.5]), stream=self.stream)
+        self.stream.seek(0)
+
+        output = streaming.map_msgpack_record_reader(stream=self.stream)
+        self.assertEqual(output.next(), ('a', [1, True, {"key": "value"}]))
+        self.assertEqual(output.next(), ('b', [2.5]))
+        self.assertRaises(StopIteration, next, output)
+
+    def testRawBytesFraming(self):
+        streaming.emit_msgpack('a', [10], stream=self.stream)
+        self.assertEqual(self.stream.getvalue(),
+            '\x00\x00\x00\x03\xc4\x01a\x00\x00\x00\x02\x91\x0a')
+
+    def testTruncated(self):
+        streaming.emit_msgpack('a', [10], stream=self.stream)
+        self.stream.truncate(self.stream.tell() - 1)
+        self.stream.seek(0)
+
+        output = streaming.map_msgpack_record_reader(stream=self.stream)
+        self.assertRaises(RuntimeError, next, output)
+
 
 # -----------------------------------------------------------------------------
 # TestReduceRecordGrouper
@@ -107,6 +371,44 @@ class TestReduceRecordGrouper(unittest.TestCase):
             "200", [["1", "2", "3", "4"], ["5", "6", "7", "8"]]))
         self.assertRaises(StopIteration, next, output)
 
+    def testKeyFunc(self):
+        self.input_stream.write("100\tA\n")
+        self.input_stream.write("101\tB\n")
+        self.input_stream.write("200\tC\n")
+        self.input_stream.seek(0)
+
+        output = streaming.reduce_record_grouper(
+            stream=self.input_stream, key_func=lambda record: record[0][0],
+            delimiter=None)
+        self.assertEqual(output.next(), ("1", ["A", "B"]))
+        self.assertEqual(output.next(), ("2", ["C"]))
+        self.assertRaises(StopIteration, next, output)
+
+    def testMaxSplit(self):
+        self.input_stream.write("100\tA,B,C,D\n")
+        self.input_stream.seek(0)
+
+        output = streaming.reduce_record_grouper(
+            stream=self.input_stream, delimiter=",", maxsplit=1)
+        self.assertEqual(output.next(), ("100", [["A", "B,C,D"]]))
+        self.assertRaises(StopIteration, next, output)
+
+    def testDelimiters(self):
+        self.input_stream.write("100\tA,B;C::D\n")
+        self.input_stream.seek(0)
+
+        output = streaming.reduce_record_grouper(
+            stream=self.input_stream, delimiter=[",", ";", ":", "::"])
+        self.assertEqual(output.next(), ("100", [["A", "B", "C", "D"]]))
+        self.assertRaises(StopIteration, next, output)
+
+    def testIterable(self):
+        output = streaming.reduce_record_grouper(
+            stream=["100\tA\n", "100\tB\n", "200\tC\n"], delimiter=None)
+        self.assertEqual(output.next(), ("100", ["A", "B"]))
+        self.assertEqual(output.next(), ("200", ["C"]))
+        self.assertRaises(StopIteration, next, output)
+
 
 # -----------------------------------------------------------------------------
 # TestTimeBasedSessionizer
@@ -121,6 +423,26 @@ class TestTimeBasedSessionizer(unittest.TestCase):
         self.assertEqual(output.next(), (16, 16, [[16, "D"]]))
         self.assertRaises(StopIteration, next, output)
 
+    def testSessionizerIterator(self):
+        output = streaming.time_based_sessionizer(
+            iter([[1, "A"], [2, "B"], [10, "C"], [16, "D"]]), 5)
+        self.assertEqual(output.next(), (1,  2,  [[1,  "A"], [2, "B"]]))
+        self.assertEqual(output.next(), (10, 10, [[10, "C"]]))
+        self.assertEqual(output.next(), (16, 16, [[16, "D"]]))
+        self.assertRaises(StopIteration, next, output)
+
+    @unittest.skipIf(numpy is None, "requires numpy")
+    def testSessionizerArrays(self):
+        output = streaming.time_based_sessionizer(
+            [[1, 10], [2, 20], [10, 30]], 5, as_arrays=True)
+        start, end, data = output.next()
+        self.assertEqual((start, end), (1, 2))
+        self.assertEqual(data.tolist(), [[1, 10], [2, 20]])
+        self.assertEqual(data.sum(axis=0).tolist(), [3, 30])
+        start, end, data = output.next()
+        self.assertEqual((start, end, data.tolist()), (10, 10, [[10, 30]]))
+        self.assertRaises(StopIteration, next, output)
+
 
 # -----------------------------------------------------------------------------
 # Bootstrap